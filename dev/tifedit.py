@@ -4,12 +4,22 @@ import sys
 import glob
 import pandas as pd
 from osgeo import gdal
+from concurrent.futures import ProcessPoolExecutor
 
 drv = gdal.GetDriverByName("GTiff")
 
+# column types for reading a bands table back from csv
+BANDS_DTYPES = {
+    "GeoTIFF": str, "Band": int, "Description": str, "Metadata": str}
+
+def opentif(geotiff):
+    # read-only raster open; GTiff only, so no probing of other drivers
+    return(gdal.OpenEx(
+        geotiff, gdal.OF_RASTER | gdal.OF_READONLY, allowed_drivers=["GTiff"]))
+
 def getbands(geotiff, verbose = False):
     print("~ Processing: "+geotiff)
-    raster = gdal.Open(geotiff)
+    raster = opentif(geotiff)
     bands = []
 
     for bandnumber in range(1, raster.RasterCount+1):
@@ -27,20 +37,22 @@ def getbands(geotiff, verbose = False):
 
 def writegeotiff(geotiff=None, bands=None, tail="_edit.tif"):
 
-    # duplicate input dataset and open;  
+    # duplicate input dataset (pixels included) and open; 
     outraster = drv.CreateCopy(
         os.path.splitext(geotiff)[0]+tail,  # output geotiff
-        gdal.Open(geotiff))                 # input gdal raster dataset   
+        opentif(geotiff))                   # input gdal raster dataset   
+
+    # index table rows by band number once for direct lookups
+    bands = bands.set_index("Band", drop=False)
 
     # iterate over bands; write info from table
     for bandnumber in range(1, outraster.RasterCount+1):
 
         try:
-            bandrow = bands.loc[bands["Band"]==bandnumber]
+            bandrow = bands.loc[bandnumber]
             band = outraster.GetRasterBand(bandnumber)
-            band.WriteArray(band.ReadAsArray())
-            band.SetDescription(bandrow['Description'].item())
-            band.SetMetadata(bandrow['Metadata'].item())
+            band.SetDescription(bandrow.Description)
+            band.SetMetadata(bandrow.Metadata)
 
         except:
             print("No row found for band "+str(bandnumber)+". Skipping.")
@@ -56,15 +68,24 @@ if __name__ == '__main__':
     elif os.path.isdir(sys.argv[1]):
         print("Got input path. Writing GeoTIFF bands table.")
         tifs = glob.glob(sys.argv[1]+"/*.tif")
-        df = pd.concat([getbands(t) for t in tifs])
-        df.to_csv("bands.csv")
+        with ProcessPoolExecutor() as ex:   # one process per GeoTIFF
+            df = pd.concat(ex.map(getbands, tifs), ignore_index=True)
+        try:
+            df.to_feather("bands.feather")
+        except ImportError:   # feather needs pyarrow; fall back to csv
+            df.to_csv("bands.csv")
 
     elif os.path.isfile(sys.argv[1]):
-        print("Got input file. Writing new GeoTIFFs from CSV info.")
-        bands = pd.read_csv(sys.argv[1])
-        for geotiff in bands.GeoTIFF.unique():
-            bands = bands.loc[bands["GeoTIFF"]==geotiff]
-            writegeotiff(geotiff=geotiff, bands=bands)
+        print("Got input file. Writing new GeoTIFFs from table info.")
+        if sys.argv[1].endswith(".feather"):
+            bands = pd.read_feather(sys.argv[1])
+        else:
+            bands = pd.read_csv(sys.argv[1], dtype=BANDS_DTYPES, 
+                keep_default_na=False)
+        geotiffs = bands.GeoTIFF.unique()
+        with ProcessPoolExecutor() as ex:   # one process per GeoTIFF
+            list(ex.map(writegeotiff, geotiffs, (
+                bands.loc[bands["GeoTIFF"]==g] for g in geotiffs)))
 
     else:
         print("Something went wrong. Exiting.")
\ No newline at end of file
@@ -4,43 +4,107 @@
 """
 
 import re
+import ast
 import sys
 import glob
 import json
+import math
 import shutil
 import argparse
+import functools
+import threading
 import numpy as np
 import datetime as dt
 import netCDF4 as nc4
-from calendar import monthrange
-from collections import OrderedDict
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from os.path import join, isfile, isdir, basename, splitext
 
+# numexpr is optional; used to stream fill replacement through memory once
+try:
+    import numexpr as ne
+    from numexpr.necompiler import getType
+except ImportError:
+    ne = None
+
+# orjson is optional; writes (and reads) templates faster than json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# numba is optional; jit-compiles funcx expressions numexpr can't take
+try:
+    import numba
+except ImportError:
+    numba = None
+
 # ----------------------------------------------------------------------------
 # Handle time
 # ----------------------------------------------------------------------------
     
 
-def month_bnds(x, length=None):
-    """Return tuple of month_bnds for input datetime. Length unused."""
-    return((x.replace(day=1), x.replace(day=monthrange(x.year, x.month)[1])))
+def month_bnds(t, scale, origin):
+    """Return (lo, hi) month bnds for numeric times t; keeps time of day."""
+    epoch = np.datetime64(origin, "us")
+    x = epoch+np.rint(t*scale*1e6).astype("int64").astype("timedelta64[us]")
+    tod = x-x.astype("datetime64[D]")
+    month = x.astype("datetime64[M]")
+    lo = month.astype("datetime64[D]")+tod
+    hi = (month+1).astype("datetime64[D]")-np.timedelta64(1, "D")+tod
+    return(((lo-epoch)/np.timedelta64(1, "s")/scale, 
+            (hi-epoch)/np.timedelta64(1, "s")/scale))
 
 
-def day_bnds(x, length, offset=0.5):
-    """Return tuple of day_bnds for input datetime. Length required."""
-    off = dt.timedelta(days=length.days*offset)
-    return((x-off, x+off))
+def day_bnds(t, scale, origin=None, offset=0.5):
+    """Return (lo, hi) bnds for numeric times t, +/- whole days*offset."""
+    length = (t[1]-t[0])*scale
+    off = (length//86400)*86400*offset/scale
+    return((t-off, t+off))
 
 
 # regular expressions for validating input CF units for time
+# (anchored at the start by .match; captures unit, origin date and time)
 timeunitsre = re.compile(
-    ".* since [0-9]{4}-(0[1-9]|1[0-2])-(0[1-9]|[1-2][0-9]|3[0-1])"
-    ".*(2[0-3]|[01][0-9]):[0-5][0-9]:[0-5][0-9].*")
-
-# Functions for generating time bounds from input numpy arrays
+    r"(.*?) since ([0-9]{4})-(0[1-9]|1[0-2])-(0[1-9]|[12][0-9]|3[01])"
+    r"[ T](2[0-3]|[01][0-9]):([0-5][0-9]):([0-5][0-9])")
+
+# seconds per fixed-length CF time unit, keyed by every (lowercase)
+# udunits spelling of that unit
+TIMEUNITS = {
+    1e-6: ("microseconds", "microsecond", "microsecs", "microsec", "usecs", 
+           "usec", "us"),
+    1e-3: ("milliseconds", "millisecond", "millisecs", "millisec", "msecs", 
+           "msec", "ms"),
+    1.: ("seconds", "second", "secs", "sec", "s"),
+    60.: ("minutes", "minute", "mins", "min"),
+    3600.: ("hours", "hour", "hrs", "hr", "h"),
+    86400.: ("days", "day", "d")}
+TIMESCALES = {
+    alias: scale for scale, aliases in TIMEUNITS.items() for alias in aliases}
+
+# Functions for generating time bounds from numeric time arrays
 GetTimeBnds = {
-    "months": np.vectorize(month_bnds),
-    "days": np.vectorize(day_bnds)}
+    "months": month_bnds,
+    "days": day_bnds}
+
+
+@functools.lru_cache(maxsize=32)
+def ParseTimeUnits(units):
+    """Returns (seconds per unit, origin datetime) for CF time units.
+
+    Seconds per unit is None for units that aren't a fixed length (e.g.
+    months); returns None altogether if units aren't valid CF time units.
+    """
+    match = timeunitsre.match(units)
+    if not match:
+        return(None)
+    unit, *origin = match.groups()
+    try:
+        origin = dt.datetime(*map(int, origin))
+    except ValueError:
+        return(None)   # e.g. Feb 30
+    return((TIMESCALES.get(unit.strip().lower()), origin))
 
 
 def ConvertTime(netcdf_object, time_options):
@@ -51,8 +115,8 @@ def ConvertTime(netcdf_object, time_options):
         return(None, None)
 
     elif not all([
-        timeunitsre.fullmatch(time_options['in_units']), 
-        timeunitsre.fullmatch(time_options['out_units'])]):
+        ParseTimeUnits(time_options['in_units']), 
+        ParseTimeUnits(time_options['out_units'])]):
         print("INFO: Input time units not CF compliant; no conversion.")
         return(None, None)
 
@@ -65,31 +129,52 @@ def ConvertTime(netcdf_object, time_options):
 
         # add other calendar options to code later
         in_units = time_options['in_units']
-        in_origin = in_units.split("since")[1].strip()[:19]
-        in_datetime = dt.datetime.strptime(in_origin, "%Y-%m-%d %H:%M:%S")
-        time_dt = nc4.num2date(in_time[:], in_units, calendar="standard")
+        in_scale, in_datetime = ParseTimeUnits(in_units)
         
         out_units = time_options['out_units']
-        #out_common_units = out_units.split("since")[0]
-        out_origin = out_units.split("since")[1].strip()[:19]
-        out_datetime = dt.datetime.strptime(out_origin, "%Y-%m-%d %H:%M:%S")
+        out_scale, out_datetime = ParseTimeUnits(out_units)
 
         shift = time_options["shift_time"]
-        if shift:
-            time_shift = in_datetime-out_datetime
-            time_dt = time_dt-time_shift
+        time_shift = in_datetime-out_datetime
+
+        # fixed-length units: affine transform on the raw numbers
+        if in_scale and out_scale:
+            offset = 0. if shift else time_shift.total_seconds()
+            in_seconds = np.asarray(in_time[:], np.float64)*in_scale
+            out_time = (in_seconds+offset)/out_scale
+
+        # else go through datetimes
+        else:
+            time_dt = nc4.num2date(in_time[:], in_units, calendar="standard")
+            if shift:
+                time_dt = time_dt-time_shift
+            out_time = nc4.date2num(time_dt, out_units)
 
         bnds = time_options["set_time_bnds"]
-        if bnds:
-            length = time_dt[1]-time_dt[0]
-            lo, hi = GetTimeBnds[bnds](time_dt, length)
-            out_time_bnds = [t for t in zip(
-                [nc4.date2num(t, out_units) for t in lo], 
-                [nc4.date2num(t, out_units) for t in hi])]
+        if bnds and out_scale:
+            out_time = np.asarray(out_time, np.float64)
+            lo, hi = GetTimeBnds[bnds](out_time, out_scale, out_datetime)
+            out_time_bnds = np.stack([lo, hi], axis=-1)
+
+        # no fixed scale: get bnds in seconds, then back through datetimes
+        elif bnds:
+            seconds = "seconds since {}".format(out_datetime)
+            try:
+                out_seconds = np.asarray(nc4.date2num(nc4.num2date(
+                    out_time, out_units, calendar="standard"), seconds, 
+                    calendar="standard"), np.float64)
+                out_time_bnds = np.stack([
+                    nc4.date2num(nc4.num2date(
+                        b, seconds, calendar="standard"), out_units, 
+                        calendar="standard") 
+                    for b in GetTimeBnds[bnds](out_seconds, 1., out_datetime)
+                    ], axis=-1)
+            except ValueError:
+                print("INFO: Time bnds not supported for out units; none.")
+                out_time_bnds = None
         else:
             out_time_bnds = None
 
-        out_time = nc4.date2num(time_dt, out_units)
         return(out_time, out_time_bnds)
 
 
@@ -97,7 +182,7 @@ def GetTimeUnits(structure):
     """Gets the value of variable time's 'units' attribute."""
     try:
         units = structure["variables"]["time"]["attributes"]["units"]
-        if timeunitsre.fullmatch(units):
+        if ParseTimeUnits(units):
             return(units)
         else:
             return(None)
@@ -111,18 +196,6 @@ def GetTimeUnits(structure):
 # ----------------------------------------------------------------------------
 
 
-def fmt(obj): 
-    """Value formatter replaces numpy types with base python types."""
-    if isinstance(obj, (str, int, float, complex, tuple, list, dict, set)):
-        out = obj
-    else:                        # else, assume numpy
-        try:
-            out = obj.item()     # try to get value
-        except:
-            out = obj.tolist()   # except, must be np iterable; get list
-    return(out)
-
-
 def GetDimensions(nc):
     """Returns a dictionary describing the dimensions in a netCDF file."""
     return({name: {
@@ -131,25 +204,37 @@ def GetDimensions(nc):
     for name, dim in nc.dimensions.items()})
 
 
+def FmtAttributes(d):
+    """Formats an attribute dict in one pass; numpy types to python.
+
+    Scalars and size-1 arrays become one value, other arrays lists.
+    """
+    numpy = (np.generic, np.ndarray)   # np.generic size is always 1
+    return({att: (val.item() if val.size == 1 else val.tolist()) 
+        if isinstance(val, numpy) else val
+        for att, val in d.items()})
+
+
 def GetVariables(nc):
     """Returns a dictionary describing the variables in a netCDF file."""
-    return({name: {
-        'dimensions': var.dimensions, 
-        'attributes': {att:fmt(getattr(var,att)) for att in var.ncattrs()}
-    } for name,var in nc.variables.items()})
+    variables = {}
+    for vname, v in nc.variables.items():
+        attributes = FmtAttributes(v.__dict__)   # one fetch
+        variables[vname] = {
+            'dimensions': v.dimensions, 
+            'fill_value': attributes.pop('_FillValue', None), 
+            'attributes': attributes}
+    return(variables)
 
 
 def GetGroups(nc):
     """Returns a dictionary describing the groups in a netCDF file."""
-    return({name: {
-        'variables': GetVariables(grp), 
-        'attributes': {att:fmt(getattr(name,att)) for att in grp.ncattrs()}
-    } for name, grp in nc.groups.items()})
+    return({gname: GetStructure(g) for gname, g in nc.groups.items()})
 
 
 def GetAttributes(nc):
     """Returns a dictionary describing the attributes in a netCDF file."""
-    return({att: fmt(getattr(nc, att)) for att in nc.ncattrs()})
+    return(FmtAttributes(nc.__dict__))   # one fetch
 
 
 def GetStructure(nc):
@@ -161,42 +246,67 @@ def GetStructure(nc):
         'attributes': GetAttributes(nc)})
 
 
+def VariableTable(structure, path="/"):
+    """Flattens a header to {(group path, name): (dims, attributes, fill)}.
+
+    fill is kept apart from attributes; older templates had it inside.
+    """
+    table = {}
+    for name, v in structure['variables'].items():
+        fill, attributes = v.get('fill_value'), v['attributes']
+        if '_FillValue' in attributes:
+            attributes = dict(attributes)
+            fill = attributes.pop('_FillValue')
+        table[(path, name)] = (v['dimensions'], attributes, fill)
+    for name, g in structure['groups'].items():
+        table.update(VariableTable(g, path.rstrip("/")+"/"+name))
+    return(table)
+
+
 # ----------------------------------------------------------------------------
 # Templater
 # ----------------------------------------------------------------------------
 
 
+def IterNames(structure, kind):
+    """Yields names of one kind of object in a group and its subgroups."""
+    yield from structure[kind]
+    for g in structure['groups'].values():
+        yield from IterNames(g, kind)
+
+
 def GetTemplate(nc):
     """Returns the complete EditNetCDF template as json string."""
 
-    # get structure, lists of netCDF object names to make rename table
+    # get structure, names of netCDF objects in all groups for rename table
     s = GetStructure(nc)
-    dimensions = list(s['dimensions'].keys())
-    groups = list(s['groups'].keys())
-    variables = list(s['variables'].keys())+[
-        s['groups'][g]['variables'].keys() for g in groups]
-
-    return(OrderedDict([
-        ("header", s),
-        ("updates", OrderedDict([
-            ("drop", []),
-            ("rename", {
+    dimensions = list(IterNames(s, 'dimensions'))
+    groups = list(IterNames(s, 'groups'))
+    variables = list(IterNames(s, 'variables'))
+
+    return({
+        "header": s,
+        "updates": {
+            "drop": [],
+            "rename": {
                 "dimensions": {d:d for d in dimensions},
                 "variables": {v:v for v in variables},
-                "groups": {g:g for g in groups}}),
-            ("time", OrderedDict([
-                ("in_units", GetTimeUnits(s)), 
-                ("out_units", None),
-                ("shift_time", None),  
-                ("set_time_bnds", None)])),
-            ("permute", OrderedDict([
-                ("variables1d_flip", []), 
-                ("variables2d_xflip", []), 
-                ("variables2d_yflip", [])])),
-            ("funcx", {v:[] for v,d in s['variables'].items()}),
-            ("compression_level", 4)
-        ]))
-    ]))
+                "groups": {g:g for g in groups}},
+            "time": {
+                "in_units": GetTimeUnits(s), 
+                "out_units": None,
+                "shift_time": None,  
+                "set_time_bnds": None},
+            "permute": {
+                "variables1d_flip": [], 
+                "variables2d_xflip": [], 
+                "variables2d_yflip": []},
+            "funcx": {v:[] for v,d in s['variables'].items()},
+            "compression": "zlib",
+            "compression_level": 1,
+            "shuffle": True
+        }
+    })
 
 
 # ----------------------------------------------------------------------------
@@ -204,19 +314,312 @@ def GetTemplate(nc):
 # ----------------------------------------------------------------------------
 
 
-def GetModifiers(name, permute):
-    return([{
-        "variables2d_yflip": np.flipud,
-        "variables2d_xflip": np.fliplr,
-        "variables1d_flip": lambda x: np.flip(x, 0)
-    }[mod] for mod, vars in permute.items() if name in vars])
+# updates['permute'] options, as bit flags of the axes they reverse
+FLIP0, FLIP1 = 1, 2
+PERMUTES = {
+    "variables2d_yflip": FLIP0,
+    "variables2d_xflip": FLIP1,
+    "variables1d_flip": FLIP0}
+
+# axis flags to index; negative-stride views, not copies
+FLIPS = {
+    FLIP0: np.s_[::-1], 
+    FLIP1: np.s_[:, ::-1], 
+    FLIP0 | FLIP1: np.s_[::-1, ::-1]}
+
+
+def GetModifiers(permute):
+    """Maps each permuted variable to the axes it reverses, as bit flags."""
+    flags = {}
+    for mod, vars in permute.items():
+        if mod not in PERMUTES:
+            print("Unknown permute: "+mod+". Skipping.")
+            continue
+        for name in vars:
+            flags[name] = flags.get(name, 0) ^ PERMUTES[mod]   # 2 flips: none
+    return({name: f for name, f in flags.items() if f})
+
+
+# target size of one streamed block, in whole chunks if chunked
+BLOCKBYTES = 16*2**20
+
+# most chunk cache a variable is raised to for straddling blocks; caches
+# stay allocated per open variable until the file closes
+CACHEBYTES = 256*2**20
+
+# target size of output chunks for inputs stored contiguous; smaller
+# variables are written contiguous and uncompressed
+CHUNKBYTES = 2**20
+
+
+def IterChunks(shape, chunks=None, itemsize=8):
+    """Yields slices stepping through the outermost dimension.
+
+    Blocks are about BLOCKBYTES, rounded to whole chunks along the axis.
+    """
+    if not shape:
+        yield(Ellipsis)   # scalar variable; one block
+        return
+    step = BLOCKBYTES//max(itemsize*int(np.prod(shape[1:])), 1)
+    if chunks:
+        step = max(step//chunks[0], 1)*chunks[0]
+    step = max(step, 1)
+    for i in range(0, shape[0], step):
+        yield(slice(i, min(i+step, shape[0])))
+
+
+def AutoChunks(shape, itemsize=8, target=CHUNKBYTES):
+    """Chunk shape of about target bytes, splitting the outer dims first."""
+    chunks = [max(n, 1) for n in shape]
+    for i in range(len(chunks)):
+        slab = itemsize*int(np.prod(chunks[i+1:]))
+        chunks[i] = max(min(chunks[i], target//slab), 1)
+        if slab <= target:
+            break
+    return(chunks)
+
+
+def MirrorSlice(sl, size):
+    """Returns the slice mirrored across an axis of length size."""
+    return(slice(size-sl.stop, size-sl.start))
+
+
+def IsNumeric(dtype):
+    """True if dtype is a plain int, uint, or float type."""
+    try:
+        return(np.dtype(dtype).kind in "fiu")
+    except (TypeError, ValueError):
+        return(False)   # netCDF4 compound/vlen types
+
+
+# compression codecs; all but zlib depend on how netCDF4 was built
+CODECS = {
+    "zlib": "__version__", 
+    "zstd": "__has_zstandard_support__", 
+    "bzip2": "__has_bzip2_support__"}
+
+
+def GetCompression(name):
+    """Returns codec name if netCDF4 can write it; otherwise 'zlib'."""
+    if not getattr(nc4, CODECS.get(name, ""), False):
+        print("INFO: "+str(name)+" compression not available; using zlib.")
+        return("zlib")
+    return(name)
+
+
+def SourceFilters(variable):
+    """Returns createVariable compression kwargs matching an input variable.
+
+    None if the input has no filter information (netCDF3), so the template
+    compression applies.
+    """
+    f = variable.filters()
+    if f is None:
+        return(None)
+    return({
+        "compression": next((c for c in CODECS if f.get(c)), None), 
+        "complevel": f.get("complevel", 0), 
+        "shuffle": f.get("shuffle", False)})
+
+
+def PackParams(attributes):
+    """(scale_factor, add_offset) from an attribute dict; None if unpacked."""
+    if not {"scale_factor", "add_offset"} & attributes.keys():
+        return(None)
+    return(attributes.get("scale_factor", 1.), attributes.get("add_offset", 0.))
+
+
+def Unpack(data, scale, offset):
+    """Packed values to floats: data*scale_factor+add_offset."""
+    dtype = np.result_type(data, scale, offset, np.float32)
+    out = np.multiply(data, scale, dtype=dtype)
+    out += dtype.type(offset)   # in place; no second temporary
+    return(out)
+
+
+def Pack(data, scale, offset, dtype):
+    """Floats to packed dtype, rounding for integer types."""
+    work = np.result_type(data, scale, offset, np.float32)
+    data = np.subtract(data, offset, dtype=work)
+    data /= scale   # in place on the one float temporary
+    if np.dtype(dtype).kind in "iu":
+        data = np.rint(data, out=data)
+    return(data.astype(dtype))
+
+
+def FillMask(data, value, out=None):
+    """Bool mask of the cells of data holding value; a NaN value matches NaNs."""
+    if value != value:
+        return(np.isnan(data, out=out))
+    return(np.equal(data, value, out=out))
+
+
+def InvalidSpec(attributes):
+    """(missing values, valid min, valid max) of source attributes, or None.
+    
+    These are the cells netCDF4 would mask besides _FillValue.
+    """
+    missing = attributes.get("missing_value")
+    vmin, vmax = attributes.get("valid_min"), attributes.get("valid_max")
+    if "valid_range" in attributes:
+        vmin, vmax = np.ravel(attributes["valid_range"])[:2]
+    if missing is None and vmin is None and vmax is None:
+        return(None)
+    return((np.ravel(missing) if missing is not None else (), vmin, vmax))
+
+
+def InvalidMask(data, spec):
+    """Bool mask of the cells of data that InvalidSpec spec marks invalid."""
+    missing, vmin, vmax = spec
+    mask = np.zeros(data.shape, dtype=bool)
+    for value in missing:
+        mask |= FillMask(data, data.dtype.type(value))
+    if vmin is not None:
+        mask |= data < vmin
+    if vmax is not None:
+        mask |= data > vmax
+    return(mask)
+
+
+def ReplaceFill(data, srcfill, fill, mask=None):
+    """Replaces srcfill with fill in place, without a boolean temporary.
+    
+    mask is optional bool scratch of data's shape for the numpy path.
+    """
+    raw = np.ma.getdata(data)
+    srcfill, fill = raw.dtype.type(srcfill), raw.dtype.type(fill)
+
+    # numexpr only handles a few dtypes; everything else goes to numpy
+    if ne and raw.dtype.name in ("int32", "int64", "float32", "float64"):
+        expr = "raw!=raw" if srcfill != srcfill else "raw==srcfill"
+        ne.evaluate(
+            "where(%s, fill, raw)" % expr, out=raw, casting="unsafe")
+    else:
+        np.copyto(raw, fill, where=FillMask(raw, srcfill, out=mask))
+    return(data)
+
+
+# syntax allowed in updates['funcx'] strings: arithmetic on x, numbers,
+# comparisons, abs, numpy ufuncs (plus a few helpers) called as np.<name>,
+# keyword arguments to them, and numpy constants like np.nan or np.pi
+FUNCX_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Compare, ast.Call, 
+    ast.keyword, ast.Attribute, ast.Name, ast.Constant, ast.Load, 
+    ast.operator, ast.unaryop, ast.cmpop)
+FUNCX_NPFUNCS = ("where", "clip", "round")
+FUNCX_NAMES = {"np": np, "abs": abs}
+
+# compiled funcx callables, keyed by the expression string
+_funcx_cache = {}
+
+
+def CheckFunc(tree):
+    """Raises ValueError if a parsed funcx string uses disallowed syntax."""
+    for node in ast.walk(tree):
+        if not isinstance(node, FUNCX_NODES):
+            raise ValueError("syntax not allowed: "+type(node).__name__)
+        elif isinstance(node, ast.Name) and (
+            node.id != "x" and node.id not in FUNCX_NAMES):
+            raise ValueError("unknown name: "+node.id)
+        elif isinstance(node, ast.Constant) and (
+            type(node.value) not in (int, float, complex, bool)):
+            raise ValueError("only numeric constants allowed")
+        elif isinstance(node, ast.Attribute) and not (
+            isinstance(node.value, ast.Name) and node.value.id == "np" and (
+            isinstance(getattr(np, node.attr, None), (np.ufunc, float)) or 
+            node.attr in FUNCX_NPFUNCS)):
+            raise ValueError("only np ufuncs, constants allowed: "+node.attr)
+
+
+def CompileFunc(f):
+    """Validates and compiles a funcx string once; returns func of x."""
+    if f in _funcx_cache:
+        return(_funcx_cache[f])
+
+    # safe to eval as a lambda once the expression passes CheckFunc
+    tree = ast.parse(f.strip(), mode="eval")
+    CheckFunc(tree)
+    env = {"__builtins__": {}, **FUNCX_NAMES}
+    pyfunc = eval("lambda x: ("+f.strip()+")", env)
+
+    # numexpr evaluates plain arithmetic in one threaded pass, if it can
+    usene = ne is not None and "np" not in {
+        n.id for n in ast.walk(tree) if isinstance(n, ast.Name)}
+    if usene:
+        try:
+            ne.evaluate(f, local_dict={"x": np.ones(1)})
+        except Exception:
+            usene = False
+
+    # otherwise jit the lambda; compiled lazily per dtype on first call and
+    # dropped for good if numba can't type it (no cache=True: no source file)
+    jit = [numba.njit(pyfunc)] if numba and not usene else []
+
+    # numexpr kernels compiled once per input dtype, reused for every block
+    kernels = {}
+
+    def func(x):
+        if np.ma.isMaskedArray(x):
+            return(pyfunc(x))
+        if usene:
+            try:
+                kernel = kernels.get(x.dtype)
+                if kernel is None:
+                    kernel = kernels[x.dtype] = ne.NumExpr(
+                        f, signature=[("x", getType(x))])
+                return(kernel(x))
+            except Exception:
+                pass   # e.g. dtype numexpr can't handle; use numpy
+        elif jit:
+            try:
+                return(jit[0](x))
+            except Exception:
+                del jit[:]
+        return(pyfunc(x))
+
+    # fused(x, srcfill, fill): func(x), with cells holding either fill set
+    # to fill, in one numexpr pass; kernels keyed by dtype and NaN fills
+    fusedkernels = {}
+
+    def fused(x, srcfill, fill):
+        srcfill, fill = x.dtype.type(srcfill), x.dtype.type(fill)
+        key = (x.dtype, srcfill != srcfill, fill != fill)
+        args = (fill,) if key[1] else (srcfill, fill)
+        if key not in fusedkernels:
+            fusedkernels[key] = ne.NumExpr(
+                "where(%s|%s, f, %s)" % (
+                    "(x!=x)" if key[1] else "(x==s)", 
+                    "(x!=x)" if key[2] else "(x==f)", f.strip()), 
+                signature=[("x", getType(x))]+[
+                    (n, getType(fill)) for n in "sf"[len(args) == 1:]])
+        return(fusedkernels[key](x, *args))
+
+    func.fused = fused if usene else None
+    _funcx_cache[f] = func
+    return(func)
+
+
+def GetFuncs(funcx):
+    """Maps each variable to its compiled funcx as (str, func) pairs.
+    
+    Strings that fail validation are reported once here and left out.
+    """
+    funcs = {}
+    for name, strfuncs in funcx.items():
+        for f in strfuncs:
+            try:
+                funcs.setdefault(name, []).append((f, CompileFunc(f)))
+            except Exception as e:
+                print("Function "+f+" for "+name+" is not valid:")
+                print(e)
+                print("Skipping.\n"+"-"*79)
+    return(funcs)
 
 
 def ApplyFuncs(data, funcs):
-    """Takes input data and list of str funcs; evals; applies."""
-    for f in funcs:
+    """Takes input data and list of (str, compiled func) pairs; applies."""
+    for f, func in funcs:
         try:
-            func = eval("lambda x: "+f)
             data = func(data)
         except Exception as e:
             print("Function "+f+" did not evaluate correctly:")
@@ -228,21 +631,42 @@ def ApplyFuncs(data, funcs):
 class EditNetCDF(object):
     """The big kahuna."""
 
-    def __init__(self, ncin=None, template=None, ncout=None):    
+    __slots__ = (
+        "ncin", "template", "ncout", "threads", "structure", "variables", 
+        "drop", "rename", "time", "permute", "permutes", "funcx", "funcs", 
+        "compress", "compression", "shuffle", "_scratch", "_io")
+
+    def __init__(self, ncin=None, template=None, ncout=None, threads=1):    
         self.ncin = ncin
         self.template = template
         self.ncout = ncout
+        self.threads = threads
            
         # get structure from header element of dict
         self.structure = self.template['header']
+        self.variables = VariableTable(self.structure)
             
         # get updates options from updates element of template
-        self.drop = self.template['updates']['drop']
+        self.drop = frozenset(self.template['updates']['drop'])
         self.rename = self.template['updates']['rename']
         self.time = self.template['updates']['time']
         self.permute = self.template['updates']['permute']
+        self.permutes = GetModifiers(self.permute)
         self.funcx = self.template['updates']['funcx']
+        self.funcs = GetFuncs(self.funcx)
         self.compress = self.template['updates']['compression_level']
+        self.compression = GetCompression(
+            self.template['updates'].get('compression', 'zlib'))
+        self.shuffle = self.template['updates'].get('shuffle', True)
+
+        # fills and packing are handled explicitly; read raw plain ndarrays
+        self.ncin.set_auto_maskandscale(False)
+
+        # per-thread scratch arrays reused across variables; see _mask
+        self._scratch = threading.local()
+
+        # netCDF-C is not thread-safe; serializes reads/writes across threads
+        self._io = threading.Lock()
 
         # write all changes to output netCDF
         self.Updater()
@@ -257,20 +681,18 @@ class EditNetCDF(object):
 
     def Updater(self):
         """Goes through update routine."""
-        # add global attributes
-        self.WriteGlobalAttributes()
-
-        # add dimensions
-        self.WriteDimensions()
-
-        # add root-group (ungrouped) variables; skip if in drop list
-        for name, variable in self.ncin.variables.items():           
-            if name not in self.drop:
-                self.UpdateVariable(name, variable)
-
-        # add grouped variables
-        for name, group in self.ncin.groups.items():
-            self.UpdateGroup(name, group)       
+        # every variable is written in full, so skip netCDF's prefill pass
+        self.ncout.set_fill_off()
+
+        # define root group and, recursively, subgroups; then copy data,
+        # over a thread pool if asked for
+        copies = self.UpdateGroup(self.ncin, self.ncout, self.structure)
+        if self.threads > 1:
+            with ThreadPoolExecutor(self.threads) as ex:
+                list(ex.map(lambda copy: copy(), copies))
+        else:
+            for copy in copies:
+                copy()
 
         # handle other miscellaneous updates
         self.UpdateTime()
@@ -285,13 +707,15 @@ class EditNetCDF(object):
         out_units = self.time["out_units"]
 
         if out_time is not None:
-            self.ncout.variables["time"][:] = out_time
-            self.ncout.variables["time"].units = out_units
+            time = self.ncout.variables["time"]
+            time[:] = out_time
+            time.units = out_units
         
         if out_time_bnds is not None:
             try:
-                self.ncout.variables["time_bnds"][:] = out_time_bnds
-                self.ncout.variables["time_bnds"].time = out_units
+                time_bnds = self.ncout.variables["time_bnds"]
+                time_bnds[:] = out_time_bnds
+                time_bnds.time = out_units
             except:
                 if "nv" not in self.ncout.dimensions:
                     self.ncout.createDimension("nv", 2)
@@ -300,125 +724,232 @@ class EditNetCDF(object):
                     dtype="f4", data=out_time_bnds)
 
 
-    def UpdateArray(self, name, variable, fill=None):
-        """Edit input array."""
+    def UpdateArray(
+        self, name, data, srcfill=None, fill=None, packing=None, 
+        invalid=None, flip=0):
+        """Edit input array (or one block of it).
 
-        # get input netCDF variable's underlying numpy array
-        data = variable[:]
+        packing is ((scale, offset) in, (scale, offset) out) for packed data;
+        invalid is the source InvalidSpec, cells kept as they are; flip is
+        the variable's permute flags, already checked against its ndim.
+        """
 
-        # if fill value is supplied, try to get old fill value
-        if fill:
-            try:
-                srcfill = variable.__dict__['_FillValue']
-                data[data==srcfill] = fill   # replace srcfill with fill
-            except:
-                print(name+": no _FillValue in src netCDF; no fill replace.")
+        # one numexpr-able funcx on unpacked data with fills: fill swap,
+        # funcx, and fill restore fuse into a single pass over the block
+        funcs, fused = self.funcs.get(name), None
+        if srcfill is not None and funcs and len(funcs) == 1 and (
+            not packing and invalid is None):
+            fused = funcs[0][1].fused
 
-        # get built-in numpy array modifiers; apply
-        npfuncs = GetModifiers(name, self.permute)#npfuncs=self.GetModifiers(name)
-        if npfuncs:
-            for f in npfuncs:
-                try:
-                    data = f(data)
-                except Exception as e:
-                    print("Failed to apply permute: "+str(f)+". Skipping.")
-                    print(e)
-
-        # apply updates['funcx'] user-defined string funcs
-        strfuncs = self.funcx[name]
-        if strfuncs:
-            data = ApplyFuncs(data, strfuncs)
+        # if fill value is supplied and old fill value exists, replace
+        if srcfill is not None and fused is None:
+            data = ReplaceFill(data, srcfill, fill, self._mask(data.shape))
+
+        # apply built-in numpy array modifiers, as one flipped view
+        if flip:
+            data = data[FLIPS[flip]]
+
+        if fused is not None:
+            try:
+                return(fused(data, srcfill, fill))
+            except Exception:
+                data = ReplaceFill(data, srcfill, fill, self._mask(data.shape))
+
+        # apply updates['funcx'] user-defined string funcs to unpacked
+        # values; put fill back in the cells that held it before, and the
+        # source values back in missing or out-of-range cells
+        if funcs or packing:
+            mask, dtype = None, data.dtype
+            if srcfill is not None:
+                mask = FillMask(data, fill, out=self._mask(data.shape))
+            if invalid is not None:
+                keep = InvalidMask(data, invalid)
+                kept = data[keep]
+            if packing:
+                data = Unpack(data, *packing[0])
+            if funcs:
+                data = np.asarray(ApplyFuncs(data, funcs))
+            if packing:
+                data = Pack(data, *packing[1], dtype)
+            if invalid is not None:
+                data[keep] = kept
+            if mask is not None:
+                np.copyto(data, fill, where=mask, casting="unsafe")
 
         return(data)
 
 
-    def UpdateVariable(self, name, variable):
-        """Copy/edit variable to output netCDF."""
+    def UpdateVariable(self, name, variable, spec, dst):
+        """Adds variable to output group; returns func copying its blocks.
+        
+        spec is the variable's (dimensions, attributes, fill) from template.
+        """
+        dimensions, attributes, fill = spec
 
-        # get template variables for group; get dimensions, attributes
-        template = self.structure['variables'][name]
-        attributes = template['attributes']
-        dimensions = template['dimensions']
+        # source metadata fetched once; each access calls into netCDF-C
+        srcattrs = variable.__dict__   # for fill and packing
+        datatype, shape = variable.datatype, variable.shape
+        numeric = IsNumeric(datatype)
 
-        # get and drop fill from output attributes, if exists
-        if '_FillValue' in attributes.keys():
-            fill = attributes['_FillValue']
-            del attributes['_FillValue']
-        else:
-            fill = None
+        # if fill value is supplied, try to get old fill value
+        srcfill = None
+        if fill is not None:
+            srcfill = srcattrs.get('_FillValue')
+            if srcfill is None:
+                print(name+": no _FillValue in src netCDF; no fill replace.")
 
-        # update data array to reflect changes specified in template
-        data = self.UpdateArray(name, variable, fill=fill)
+        # packed data is unpacked for funcx or a change of scale/offset
+        packing = None
+        src, out = PackParams(srcattrs), PackParams(attributes)
+        if (src or out) and (src != out or self.funcs.get(name)) and (
+            numeric):
+            packing = (src or (1., 0.), out or (1., 0.))
+
+        # missing_value and valid range cells aren't edited, as when masked
+        invalid = InvalidSpec(srcattrs) if numeric else None
+
+        # permutes only reverse axes the variable has; drop the others
+        flip = self.permutes.get(name, 0)
+        if flip >> len(shape):
+            print("Failed to apply permute to "+name+": "+
+                  str(len(shape))+"-d variable. Skipping extra axes.")
+            flip &= (1 << len(shape))-1
+
+        # reuse the input chunk shape if dimensions are unchanged
+        chunks = variable.chunking()
+        if not isinstance(chunks, list) or len(chunks) != len(dimensions):
+            chunks = None
+
+        # no permute, funcx, or fill swap: copy as-is with source filters
+        passthrough = not (
+            flip or self.funcs.get(name) or packing or 
+            (srcfill is not None and srcfill != fill))
+        filters = SourceFilters(variable) if passthrough else None
+
+        # contiguous input, rewritten or without source filters (netCDF3):
+        # chunk large outputs; leave small ones contiguous
+        itemsize = getattr(variable.dtype, "itemsize", 8)  # str: vlen
+        outchunks = chunks
+        if chunks is None and filters is None and (
+            0 < len(shape) == len(dimensions)):
+            if itemsize*int(np.prod(shape)) > CHUNKBYTES:
+                outchunks = AutoChunks(shape, itemsize)
+            elif numeric and not any(
+                d.isunlimited() for d in variable.get_dims()):
+                filters = {
+                    "compression": None, "complevel": 0, "shuffle": False}
 
         # add variable to output netCDF
-        self.WriteVariable(
-            name, dimensions, attributes, 
-            dtype=variable.datatype, data=data, fill=fill)
+        outvar = self.WriteVariable(
+            name, dimensions, attributes, dtype=datatype, 
+            fill=fill, dst=dst, chunksizes=outchunks, filters=filters)
+        if outvar is None:
+            return(None)
+        outvar.set_auto_maskandscale(False)
+
+        # chunk caches should hold a block's chunks plus a row it straddles
+        # (mirrored blocks are unaligned); only raise them past the default
+        # when that doesn't fit, and never past CACHEBYTES
+        if outchunks:
+            row = itemsize*outchunks[0]*int(np.prod(shape[1:]))
+            cache = min(max(BLOCKBYTES, row)+row, CACHEBYTES)
+            for v in (outvar, variable) if chunks else (outvar,):
+                if cache > v.get_var_chunk_cache()[0]:
+                    v.set_var_chunk_cache(cache, 4133, 1.)
+
+        # stream blocks through updates; outer-axis flips mirror the slice;
+        # netCDF/HDF5 calls hold the I/O lock, array updates run outside it
+        flip0 = flip & FLIP0
+        def copy():
+            try:
+                for sl in IterChunks(shape, outchunks, itemsize):
+                    with self._io:
+                        data = variable[sl]
+                        if passthrough:
+                            outvar[sl] = data
+                            continue
+                    data = self.UpdateArray(
+                        name, data, srcfill, fill, packing, invalid, flip)
+                    if flip0:
+                        sl = MirrorSlice(sl, shape[0])
+                    with self._io:
+                        outvar[sl] = data
 
+            except Exception as e:
+                print("WARNING: Failed to write variable: "+name)
+                print(e)
+                print("Skipping.\n"+"-"*79)
 
-    def UpdateGroup(self, name, group):
-        """Copy/edit grouped variables to output netCDF."""
+        return(copy)
 
-        # get template variables for group
-        variables = self.structure['groups'][name]
 
-        # get new (or old) group name from input json
-        groupname = self.rename['groups'][name]
+    def UpdateGroup(self, src, dst, structure):
+        """Define a group and, recursively, its subgroups in output.
         
-        # make group in output file
-        self.ncout.createGroup(groupname)
-
-        # a prefix will be added to variable names; netCDF4-python req
-        nameprefix = "/"+groupname+"/"
-
-        # iterate over group's variables in input netCDF
-        for variablename, variable in group.items():
-
-            # get input netCDF variable data type
-            dtype = variable.datatype
-
-            # get dimensions, attributes given in template
-            attributes = variables[variablename]['attributes']
-            dimensions = variables[variablename]['dimensions']
-
-            # get and drop fill from output attributes, if exists
-            if '_FillValue' in attributes.keys():
-                fill = attributes['_FillValue']
-                del attributes['_FillValue']
-            else:
-                fill = None
-
-            # update data array to reflect changes specified in template
-            data = self.UpdateArray(name, variable, fill=fill)
+        Returns the data copy funcs of all variables defined.
+        """
+
+        # add group attributes, dimensions
+        self.WriteAttributes(dst, structure)
+        self.WriteDimensions(src, dst, structure)
+
+        # add group variables; skip if in drop list by name or by full path;
+        # a variable whose metadata fails is skipped, not the whole file
+        copies, path = [], src.path
+        prefix = path.rstrip("/")+"/"
+        for name, variable in src.variables.items():           
+            if name in self.drop or prefix+name in self.drop:
+                continue
+            try:
+                copies.append(self.UpdateVariable(
+                    name, variable, self.variables[(path, name)], dst))
+            except Exception as e:
+                print("WARNING: Failed to write variable: "+name)
+                print(e)
+                print("Skipping.\n"+"-"*79)
 
-            # add variable to output netCDF group
-            self.WriteVariable(
-                variablename, dimensions, attributes, 
-                dtype=dtype, data=data, fill=fill, prefix=nameprefix)
+        # make subgroups under new (or old) names; copy into them
+        for name, group in src.groups.items():
+            subgroup = dst.createGroup(self.rename['groups'].get(name, name))
+            copies += self.UpdateGroup(
+                group, subgroup, structure['groups'][name])
+        
+        return([c for c in copies if c is not None])
 
 
     # use byte dtype for default (testing add vars not in source netCDF)
     def WriteVariable( 
         self, name, dimensions, attributes, 
-        dtype=None, data=None, fill=None, prefix=None):
-            """Adds variable to output netCDF."""
+        dtype=None, data=None, fill=None, dst=None, chunksizes=None, 
+        filters=None):
+            """Adds variable to output group (default root); returns it."""
+            
+            # compression from template unless filters given; 0 disables;
+            # shuffle (byte transpose) lets numeric data deflate at level 1
+            if filters is None:
+                codec = self.compression if self.compress else None
+                filters = {
+                    "compression": codec, 
+                    "complevel": self.compress, 
+                    "shuffle": self.shuffle and IsNumeric(dtype)}
             
-            # get new name (or old name, whatever); add prefix if group
+            # get new name (or old name, whatever)
             try:
                 newname = self.rename['variables'][name]
-                if prefix:
-                    newname = prefix+newname
             except:
                 print("INFO: Output variable "+name+" has no rename entry.")
                 newname = name
 
-            # make output variable; add attributes;
+            # make output variable; add attributes; add data if given
             try:                
-                self.ncout.createVariable( 
-                    newname, dtype, dimensions, zlib=True, 
-                    complevel=self.compress, fill_value=fill)
-                self.ncout[newname].setncatts(attributes)
-                self.ncout[newname][:] = data
+                dst = self.ncout if dst is None else dst
+                outvar = dst.createVariable( 
+                    newname, dtype, dimensions, fill_value=fill, 
+                    chunksizes=chunksizes, **filters)
+                outvar.setncatts(attributes)
+                if data is not None:
+                    outvar[:] = data
+                return(outvar)
 
             except Exception as e:
                 print("WARNING: Failed to write variable: "+newname)
@@ -426,31 +957,47 @@ class EditNetCDF(object):
                 print("Skipping.\n"+"-"*79)
 
 
-    def WriteGlobalAttributes(self):
-        """Internal use. Copy global attributes all at once via dictionary."""
-        self.ncout.setncatts(self.structure['attributes'])
+    def WriteAttributes(self, dst, structure):
+        """Internal use. Copy group attributes all at once via dictionary."""
+        dst.setncatts(structure['attributes'])
 
 
-    def WriteDimensions(self):
-        """Internal use. Create new dimensions in output netCDF."""
+    def WriteDimensions(self, src, dst, structure):
+        """Internal use. Create a group's new dimensions in output netCDF."""
+
+        # unlimited dims first (stable sort keeps input order otherwise)
+        unlimited = {
+            n for n, d in structure["dimensions"].items() 
+            if d["UNLIMITED"]}
+        dimensions = sorted(
+            src.dimensions.items(), 
+            key=lambda kv: kv[0] not in unlimited)
 
         # iterate over input dimensions. check template for rename
-        for name, dimension in self.ncin.dimensions.items():
-            newname = self.rename['dimensions'][name]
+        for name, dimension in dimensions:
+            newname = self.rename['dimensions'].get(name, name)
             
             # None if dim['UNLIMITED'] is true in input template; else size
-            if self.structure["dimensions"][name]["UNLIMITED"]:
+            if name in unlimited:
                 size = None
             else:
                 size = len(dimension)
             
-            # create dimension in output file
-            self.ncout.createDimension(newname, size)
+            # create dimension in output group
+            dst.createDimension(newname, size)
 
 
     # ------------------------------------------------------------------------
     # strictly internal, of no use outside script
 
+    def _mask(self, shape):
+        """Returns bool scratch of shape, from a buffer that only grows."""
+        size = int(np.prod(shape))
+        buf = getattr(self._scratch, "mask", None)
+        if buf is None or buf.size < size:
+            buf = self._scratch.mask = np.empty(size, dtype=bool)
+        return(buf[:size].reshape(shape))
+
     def _findv(self, name):
         """Search template header section for variable; returns if exists."""
         
@@ -476,66 +1023,156 @@ def args_parser():
     p = argparse.ArgumentParser(
         description=scripthelp,
         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-    p.add_argument("ncin", help="Input netCDF")
+    p.add_argument("ncin", help="Input netCDF, directory, or quoted glob")
     p.add_argument("jsin", nargs="?", default=None, help="Input JSON")
     p.add_argument("ncout", nargs="?", default=None, help="Output netCDF")
+    p.add_argument(
+        "-t", "--threads", type=int, default=1, 
+        help="Threads per file for editing variable data")
+    p.add_argument(
+        "-p", "--parallel", action="store_true", 
+        help="Read inputs with MPI-IO (needs mpi4py, parallel netCDF4)")
     args = p.parse_args()
 
     # determine template mode or edit mode based on number of arguments
     ncin, jsin, ncout  = args.ncin, args.jsin, args.ncout
 
-    # check argument 1: input netCDF
-    try:
-        input_dataset = nc4.Dataset(ncin)
-    except:
-        sys.exit(print("ERROR: Invalid file passed to arg 1. Exiting."))
+    # check argument 1: input netCDF(s); a directory means all its *.nc
+    ncins = sorted(glob.glob(join(ncin, "*.nc") if isdir(ncin) else ncin))
+    ncins = [f for f in ncins if isfile(f)]
+    if not ncins:
         print(scripthelp)
+        sys.exit(print("ERROR: Invalid file passed to arg 1. Exiting."))
 
-    # if argument 3 exists, check argument 2: output netCDF
+    # if argument 2 exists, check arguments 2 and 3: template, output
     if jsin:
-        # if argument 2 is a dir, make output filename from arg1
-        if isdir(ncout):
-            ncout = ncout+"/"+basename(splitext(ncin)[0])+"_edit.nc"
-            print("INFO: Argument 2 is a directory, saving as: "+ncout)
-
         # try to open json template
         try:
-            with open(jsin, "r") as j:
-                template = json.load(j)
+            template = ReadTemplate(jsin)
         except:
-            sys.exit(print("ERROR: Failed to read arg2. Exit."))
             print(scripthelp)
+            sys.exit(print("ERROR: Failed to read arg2. Exit."))
 
-        # try to open output
-        try:
-            output_dataset = nc4.Dataset(ncout, "w")
-        except:
-            sys.exit(print("ERROR: Failed to read arg3. Exiting."))
+        # if argument 3 is a dir, make output filenames from arg1
+        if ncout and isdir(ncout):
+            ncouts = [
+                join(ncout, basename(splitext(f)[0])+"_edit.nc") 
+                for f in ncins]
+            print("INFO: Argument 3 is a directory, saving to: "+ncout)
+        elif ncout and len(ncins) == 1:
+            ncouts = [ncout]
+        else:
             print(scripthelp)
+            sys.exit(print("ERROR: arg3 must be a directory for multiple "
+                           "inputs, or a file for one. Exiting."))
+
+        return("edit", [
+            (f, template, o, args.threads, args.parallel) 
+            for f, o in zip(ncins, ncouts)])
 
     else:
-        output_dataset = None
-        template = splitext(ncin)[0]+".json"
+        return("template", [
+            (f, splitext(f)[0]+".json", args.parallel) for f in ncins])
 
-    return(input_dataset, template, output_dataset)
 
+def OpenInput(ncin, parallel=False):
+    """Opens input netCDF read-only; parallel reads go through MPI-IO.
+
+    Each MPI rank works on its own files, so the file is opened by this
+    rank alone (COMM_SELF); outputs are written by the same rank.
+    """
+    if not parallel:
+        return(nc4.Dataset(ncin))
+
+    # mpi4py is optional; only imported when asked for
+    from mpi4py import MPI
+    info = MPI.Info.Create()
+    info.Set("nc_header_read_chunk_size", "1048576")
+    return(nc4.Dataset(
+        ncin, "r", parallel=True, comm=MPI.COMM_SELF, info=info))
 
-if __name__ == '__main__':
-    
-    # handle arguments, validate; return open file(s) # C:\Users\jjmcn\git\netCDFeditor\ncedit.py
-    input_dataset, template, output_dataset = args_parser()
 
-    # if no args 2, write json template
-    if output_dataset is None:
+def HasNonFinite(obj):
+    """True if a NaN or inf float is anywhere in a nested dict/list."""
+    if isinstance(obj, float):
+        return(not math.isfinite(obj))
+    if isinstance(obj, dict):
+        obj = obj.values()
+    elif not isinstance(obj, (list, tuple)):
+        return(False)
+    return(any(HasNonFinite(o) for o in obj))
+
+
+def ReadTemplate(path):
+    """Reads a json template."""
+    with open(path, "rb") as j:
+        return(ParseTemplate(j.read()))
+
+
+def ParseTemplate(text):
+    """Parses json template text."""
+    if orjson:
+        try:
+            return(orjson.loads(text))
+        except orjson.JSONDecodeError:
+            pass   # e.g. NaN, Infinity, which only the json module accepts
+    return(json.loads(text))
+
+
+def TemplateJob(ncin, template, parallel=False):
+    """Writes the json template for one input netCDF."""
+    with OpenInput(ncin, parallel) as input_dataset:
         output_template = GetTemplate(input_dataset)
+
+    # orjson writes NaN and inf as null, which would drop e.g. a NaN fill
+    if orjson and not HasNonFinite(output_template):
+        text = orjson.dumps(output_template, option=(
+            orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY))
+        with open(template, "wb") as j:
+            j.write(text)
+    else:
         with open(template, "w") as j:
             json.dump(output_template, j, indent=4)
 
-    # else, write changes to output netCDF
-    else:
-        # pass to job function
-        editor = EditNetCDF(input_dataset, template, output_dataset)
 
-        # close input and output netCDFs
-        input_dataset.close()
-        output_dataset.close()
\ No newline at end of file
+def EditJob(ncin, template, ncout, threads=1, parallel=False):
+    """Writes one output netCDF from an input netCDF and a template."""
+    with OpenInput(ncin, parallel) as input_dataset:
+        with nc4.Dataset(ncout, "w") as output_dataset:
+            EditNetCDF(input_dataset, template, output_dataset, threads)
+
+
+# job functions by mode name; names (not functions) go to the workers
+Jobs = {"template": TemplateJob, "edit": EditJob}
+
+
+def run_job(job, mode_name):
+    """Runs one job; failures are reported so other files can finish."""
+    try:
+        Jobs[mode_name](*job)
+    except Exception as e:
+        print("ERROR: Failed to process "+job[0]+":")
+        print(e)
+        print("Skipping.\n"+"-"*79)
+
+
+if __name__ == '__main__':
+    
+    # handle arguments, validate; return mode and per-file jobs
+    mode_name, jobs = args_parser()
+
+    # under MPI, mpirun already started the processes; each rank takes
+    # every size-th file so no two ranks write the same output
+    if jobs[0][-1]:
+        from mpi4py import MPI
+        comm = MPI.COMM_WORLD
+        for job in jobs[comm.Get_rank()::comm.Get_size()]:
+            run_job(job, mode_name)
+
+    # files are independent; run one process per file when several
+    elif len(jobs) == 1:
+        for job in jobs:
+            run_job(job, mode_name)
+    else:
+        with ProcessPoolExecutor() as ex:
+            list(ex.map(run_job, jobs, repeat(mode_name)))